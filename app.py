@@ -4,29 +4,133 @@ HEIC 변환 웹 서비스 - FastAPI
 오늘 하루 만에 완성하는 MVP
 """
 
+import hashlib
+import io
+import multiprocessing
 import os
 import shutil
 import tempfile
+import threading
 import uuid
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 import zipfile
 import asyncio
+import time
 from datetime import datetime
 
+from cachetools import LRUCache, TTLCache
+from zipstream import ZipStream
 from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
+from fastapi.responses import FileResponse, JSONResponse, HTMLResponse, StreamingResponse
 import uvicorn
 
 # HEIC 변환 관련
 from PIL import Image
+import pillow_heif
 from pillow_heif import register_heif_opener
 
 # HEIC 지원 등록
 register_heif_opener()
 
-app = FastAPI(title="HEIC Converter API", version="1.0.0")
+# 변환 워커 프로세스 수와 워커별 디코딩 스레드 수
+WORKER_COUNT = os.cpu_count() or 1
+WORKER_DECODE_THREADS = 2
+
+# 배치 동시 변환 개수 (워커 풀이 놀지 않도록 워커 수와 같게 설정)
+BATCH_CONCURRENCY = WORKER_COUNT
+
+def _init_worker():
+    """변환 워커 프로세스 초기화"""
+    register_heif_opener()
+    pillow_heif.options.DECODE_THREADS = WORKER_DECODE_THREADS
+
+# libvips가 설치되어 있으면 네이티브 파이프라인 사용 (없으면 Pillow로 대체)
+# (pyvips 패키지만 있고 libvips 공유 라이브러리가 없으면 OSError 발생)
+try:
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
+
+def _vips_can_decode_heic() -> bool:
+    """libvips가 HEVC로 인코딩된 HEIC를 실제로 디코딩할 수 있는지 확인
+    
+    libheif에 HEVC 디코더 플러그인(libde265)이 없는 빌드(pyvips[binary] 등)는 HEIC 로드에 실패함
+    """
+    try:
+        buffer = io.BytesIO()
+        Image.new('RGB', (16, 16)).save(buffer, format='HEIF')
+        pyvips.Image.new_from_buffer(buffer.getvalue(), '').avg()
+        return True
+    except Exception:
+        return False
+
+# HEIC를 디코딩하지 못하는 libvips면 Pillow(pillow-heif)로 처리
+if pyvips is not None and not _vips_can_decode_heic():
+    pyvips = None
+
+# blake3가 있으면 SIMD 해시 사용 (없으면 hashlib의 blake2b로 대체)
+try:
+    from blake3 import blake3 as content_hash
+except ImportError:
+    content_hash = hashlib.blake2b
+
+# 동일한 업로드의 변환 결과 캐시 크기 (바이트)
+CONVERSION_CACHE_BYTES = 256 * 1024 * 1024
+
+# 변환 워커 프로세스 풀 (GIL 없이 여러 코어에서 병렬 변환)
+process_pool = None
+_pool_lock = threading.Lock()
+# 워커 비정상 종료로 풀을 다시 만든 횟수 (/health에 표시)
+pool_restarts = 0
+
+def _new_process_pool() -> ProcessPoolExecutor:
+    # 이벤트 루프 스레드/libvips가 이미 떠 있는 프로세스를 fork하지 않도록 spawn 사용
+    return ProcessPoolExecutor(
+        max_workers=WORKER_COUNT,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+    )
+
+def _replace_broken_pool(broken: ProcessPoolExecutor):
+    """워커가 죽어(OOM 등) 망가진 풀을 새 풀로 교체 (동시에 실패한 요청들이 한 번만 교체하도록 잠금)"""
+    global process_pool, pool_restarts
+    with _pool_lock:
+        if process_pool is broken:
+            process_pool = _new_process_pool()
+            pool_restarts += 1
+            broken.shutdown(wait=False, cancel_futures=True)
+
+async def run_in_pool(func, *args):
+    """워커 풀에서 실행
+    
+    워커가 비정상 종료되면 풀을 다시 만들고 이 요청은 실패 처리함
+    (같은 입력을 재시도하면 새 풀도 다시 망가질 수 있으므로 재시도하지 않음)
+    """
+    pool = process_pool
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        _replace_broken_pool(pool)
+        raise Exception("변환 워커가 비정상 종료되었습니다")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """시작 시 워커 풀과 임시 파일 정리 작업을 띄우고 종료 시 정리"""
+    global process_pool
+    process_pool = _new_process_pool()
+    cleanup_task = asyncio.create_task(periodic_cleanup())
+    try:
+        yield
+    finally:
+        cleanup_task.cancel()
+        process_pool.shutdown(cancel_futures=True)
+
+app = FastAPI(title="HEIC Converter API", version="1.0.0", lifespan=lifespan)
 
 # CORS 설정
 app.add_middleware(
@@ -41,40 +145,216 @@ app.add_middleware(
 TEMP_DIR = Path("temp_files")
 TEMP_DIR.mkdir(exist_ok=True)
 
-# 변환 작업 상태 저장
-conversion_status = {}
+# 작업 상태/임시 파일 보관 시간 (초)
+JOB_TTL_SECONDS = 3600
+CLEANUP_INTERVAL_SECONDS = 300
+
+# 변환 작업 상태 저장 (오래된 작업은 자동으로 제거)
+conversion_status = TTLCache(maxsize=10000, ttl=JOB_TTL_SECONDS)
+
+# 진행 중인 배치 작업 수 (상태 전체를 훑지 않도록 따로 집계)
+active_jobs = 0
+
+def cleanup_temp_dir():
+    """보관 시간이 지난 임시 파일/작업 디렉토리 삭제"""
+    cutoff = time.time() - JOB_TTL_SECONDS
+    with os.scandir(TEMP_DIR) as entries:
+        for entry in entries:
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime >= cutoff:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.unlink(entry.path)
+            except OSError as e:
+                print(f"임시 파일 삭제 실패 {entry.path}: {e}")
+
+async def periodic_cleanup():
+    """주기적으로 임시 디렉토리 정리"""
+    while True:
+        await asyncio.to_thread(cleanup_temp_dir)
+        await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
+
+# 형식별 저장 옵션 (변환할 때마다 분기/생성하지 않도록 미리 계산)
+_PIL_FORMAT = {'jpeg': 'JPEG', 'jpg': 'JPEG', 'png': 'PNG', 'bmp': 'BMP', 'webp': 'WEBP'}
+_NEEDS_RGB = frozenset(['jpeg', 'jpg'])
+_VIPS_QUALITY_FORMATS = frozenset(['jpeg', 'jpg', 'webp'])
+# libvips에 BMP 저장기가 없으므로(ImageMagick 빌드 필요) BMP는 항상 Pillow로 처리
+_VIPS_FORMATS = frozenset(['jpeg', 'jpg', 'png', 'webp'])
+
+_PIL_SAVE_KWARGS = {
+    'jpeg': {'optimize': True, 'progressive': True},
+    'jpg': {'optimize': True, 'progressive': True},
+    'png': {'optimize': True},
+    'bmp': {},
+    'webp': {},
+}
+_PIL_BATCH_SAVE_KWARGS = {
+    **_PIL_SAVE_KWARGS,
+    'jpeg': {'optimize': False, 'progressive': False},
+    'jpg': {'optimize': False, 'progressive': False},
+}
+
+_VIPS_SAVE_OPTIONS = {
+    'jpeg': {'optimize_coding': True, 'interlace': True, 'strip': True},
+    'jpg': {'optimize_coding': True, 'interlace': True, 'strip': True},
+    'png': {'compression': 9, 'strip': True},
+    'webp': {'strip': True},
+}
+_VIPS_BATCH_SAVE_OPTIONS = {
+    **_VIPS_SAVE_OPTIONS,
+    'jpeg': {'optimize_coding': False, 'interlace': False, 'strip': True},
+    'jpg': {'optimize_coding': False, 'interlace': False, 'strip': True},
+}
 
 class HEICConverter:
     def __init__(self):
         self.supported_formats = ['jpeg', 'png', 'bmp', 'webp']
+        # (내용 해시, 형식, 품질, 배치 여부) -> 변환 결과
+        self._cache = LRUCache(maxsize=CONVERSION_CACHE_BYTES, getsizeof=len)
+        self._cache_lock = threading.Lock()
     
-    def convert_file(self, input_path: Path, output_format: str = 'jpeg', quality: int = 90) -> Path:
-        """단일 HEIC 파일 변환"""
+    def convert_file(self, input_path: Path, output_format: str = 'jpeg', quality: int = 90, batch: bool = False,
+                     max_edge: Optional[int] = None) -> Path:
+        """단일 HEIC 파일 변환
+        
+        batch=True이면 JPEG 허프만 최적화/프로그레시브 인코딩을 생략하여 속도를 우선함
+        max_edge를 주면 긴 변이 max_edge 이하가 되도록 축소 (가능하면 디코딩 단계에서 축소)
+        """
         try:
             output_path = input_path.with_suffix(f'.{output_format}')
+            fmt = output_format.lower()
             
-            with Image.open(input_path) as img:
-                # JPEG의 경우 RGBA를 RGB로 변환
-                if output_format.lower() in ['jpeg', 'jpg'] and img.mode in ('RGBA', 'LA', 'P'):
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                    img = background
-                
-                # 저장 옵션
-                save_kwargs = {}
-                if output_format.lower() in ['jpeg', 'jpg']:
-                    save_kwargs = {'quality': quality, 'optimize': True}
-                elif output_format.lower() == 'png':
-                    save_kwargs = {'optimize': True}
-                
-                img.save(output_path, format=output_format.upper(), **save_kwargs)
+            if pyvips is not None and fmt in _VIPS_FORMATS:
+                img = self._load_vips(input_path, max_edge)
+                img = self._flatten_vips(img, fmt)
+                img.write_to_file(str(output_path), **self._vips_save_options(fmt, quality, batch))
+            else:
+                with Image.open(input_path) as img:
+                    self._save_with_pillow(img, output_path, fmt, quality, batch, max_edge)
                 
             return output_path
             
         except Exception as e:
             raise Exception(f"변환 실패: {str(e)}")
+    
+    async def convert_bytes_async(self, data: bytes, output_format: str = 'jpeg', quality: int = 90,
+                                  batch: bool = False, max_edge: Optional[int] = None) -> bytes:
+        """메모리상의 HEIC 데이터 변환 (중간 파일 없이 인코딩 결과를 바로 반환)
+        
+        디코딩/인코딩은 워커 프로세스 풀에서 실행함.
+        같은 내용을 같은 옵션으로 다시 변환하면 캐시된 결과를 반환하며,
+        캐시는 현재 프로세스에서 조회/저장하므로 워커 프로세스가 달라도 재사용됨
+        """
+        fmt = output_format.lower()
+        # 큰 업로드의 해시 계산이 이벤트 루프를 막지 않도록 스레드에서 실행
+        key = await asyncio.to_thread(self._cache_key, data, fmt, quality, batch, max_edge)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        
+        result = await run_in_pool(self._encode_bytes, data, fmt, quality, batch, max_edge)
+        self._cache_put(key, result)
+        return result
+    
+    def __getstate__(self):
+        # 워커 프로세스로 보낼 때 캐시와 락은 제외 (락은 pickle 불가)
+        state = self.__dict__.copy()
+        del state['_cache'], state['_cache_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache = LRUCache(maxsize=CONVERSION_CACHE_BYTES, getsizeof=len)
+        self._cache_lock = threading.Lock()
+    
+    def _cache_key(self, data: bytes, fmt: str, quality: int, batch: bool, max_edge: Optional[int]) -> tuple:
+        return (content_hash(data).digest(), fmt, quality, batch, max_edge)
+    
+    def _cache_get(self, key: tuple):
+        with self._cache_lock:
+            return self._cache.get(key)
+    
+    def _cache_put(self, key: tuple, result: bytes):
+        with self._cache_lock:
+            # 캐시 전체보다 큰 결과는 저장하지 않음
+            if len(result) <= self._cache.maxsize:
+                self._cache[key] = result
+    
+    def _encode_bytes(self, data: bytes, fmt: str, quality: int, batch: bool, max_edge: Optional[int]) -> bytes:
+        """캐시 없이 HEIC 데이터를 변환"""
+        try:
+            if pyvips is not None and fmt in _VIPS_FORMATS:
+                img = self._load_vips(data, max_edge)
+                img = self._flatten_vips(img, fmt)
+                return img.write_to_buffer(f'.{fmt}', **self._vips_save_options(fmt, quality, batch))
+            
+            with Image.open(io.BytesIO(data)) as img:
+                buffer = io.BytesIO()
+                self._save_with_pillow(img, buffer, fmt, quality, batch, max_edge)
+                return buffer.getvalue()
+            
+        except Exception as e:
+            raise Exception(f"변환 실패: {str(e)}")
+    
+    def _load_vips(self, source, max_edge: Optional[int]):
+        """libvips로 파일 경로 또는 바이트 로드 (max_edge가 있으면 디코딩 단계에서 축소)
+        
+        Pillow와 같은 픽셀 수 한도를 적용함 (헤더만 읽은 상태에서 검사하므로 디코딩 비용 없음)
+        """
+        if isinstance(source, bytes):
+            img = pyvips.Image.new_from_buffer(source, '', access='sequential')
+        else:
+            img = pyvips.Image.new_from_file(str(source), access='sequential')
+        
+        # Image.open과 같은 기준 (한도의 2배를 넘으면 디컴프레션 폭탄으로 판단)
+        limit = Image.MAX_IMAGE_PIXELS
+        if limit and img.width * img.height > 2 * limit:
+            raise Image.DecompressionBombError(
+                f"Image size ({img.width * img.height} pixels) exceeds limit of {2 * limit} pixels, "
+                "could be decompression bomb DOS attack."
+            )
+        
+        if max_edge:
+            if isinstance(source, bytes):
+                return pyvips.Image.thumbnail_buffer(source, max_edge, height=max_edge, size='down')
+            return pyvips.Image.thumbnail(str(source), max_edge, height=max_edge, size='down')
+        return img
+    
+    def _flatten_vips(self, img, fmt: str):
+        """JPEG의 경우 알파 채널을 흰 배경으로 합성 (libvips 파이프라인 안에서 실행)"""
+        if fmt in _NEEDS_RGB and img.hasalpha():
+            return img.flatten(background=[255, 255, 255])
+        return img
+    
+    def _vips_save_options(self, fmt: str, quality: int, batch: bool) -> dict:
+        """libvips 저장 옵션"""
+        options = dict((_VIPS_BATCH_SAVE_OPTIONS if batch else _VIPS_SAVE_OPTIONS)[fmt])
+        if fmt in _VIPS_QUALITY_FORMATS:
+            options['Q'] = quality
+        return options
+    
+    def _save_with_pillow(self, img: Image.Image, output, fmt: str, quality: int, batch: bool,
+                          max_edge: Optional[int] = None):
+        """Pillow로 저장 (pyvips가 없거나 libvips가 저장할 수 없는 형식일 때)"""
+        # 축소 (thumbnail은 draft를 먼저 호출하므로 JPEG 원본은 libjpeg가 축소된 상태로 디코딩)
+        if max_edge:
+            img.thumbnail((max_edge, max_edge))
+        
+        # JPEG의 경우 RGBA를 RGB로 변환
+        if fmt in _NEEDS_RGB and img.mode in ('RGBA', 'LA', 'P'):
+            if img.mode != 'RGBA':
+                img = img.convert('RGBA')
+            background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+            img = Image.alpha_composite(background, img).convert('RGB')
+        
+        # 저장 옵션
+        save_kwargs = dict((_PIL_BATCH_SAVE_KWARGS if batch else _PIL_SAVE_KWARGS)[fmt])
+        if fmt in _NEEDS_RGB:
+            save_kwargs['quality'] = quality
+        
+        img.save(output, format=_PIL_FORMAT[fmt], **save_kwargs)
 
 converter = HEICConverter()
 
@@ -86,7 +366,8 @@ async def root():
 async def convert_single_file(
     file: UploadFile = File(...),
     format: str = "jpeg",
-    quality: int = 90
+    quality: int = 90,
+    max_edge: Optional[int] = None
 ):
     """단일 파일 변환"""
     
@@ -97,17 +378,19 @@ async def convert_single_file(
     if format not in converter.supported_formats:
         raise HTTPException(status_code=400, detail=f"지원되는 형식: {converter.supported_formats}")
     
-    # 임시 파일 생성
-    job_id = str(uuid.uuid4())
-    temp_input = TEMP_DIR / f"{job_id}_input.heic"
+    if max_edge is not None and max_edge <= 0:
+        raise HTTPException(status_code=400, detail="max_edge는 1 이상이어야 합니다")
     
     try:
-        # 파일 저장
-        with open(temp_input, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # 변환 실행
-        output_path = converter.convert_file(temp_input, format, quality)
+        # 임시 파일 저장 (닫히면 자동 삭제, 이벤트 루프를 막지 않도록 스레드에서 복사)
+        with tempfile.NamedTemporaryFile(dir=TEMP_DIR, suffix='.heic') as temp_input:
+            await asyncio.to_thread(shutil.copyfileobj, file.file, temp_input)
+            temp_input.flush()
+            
+            # 변환 실행
+            output_path = await run_in_pool(
+                converter.convert_file, Path(temp_input.name), format, quality, False, max_edge
+            )
         
         # 결과 반환
         return FileResponse(
@@ -118,82 +401,129 @@ async def convert_single_file(
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
-    finally:
-        # 임시 파일 정리
-        if temp_input.exists():
-            temp_input.unlink()
 
 @app.post("/convert/batch")
 async def convert_batch_files(
     background_tasks: BackgroundTasks,
     files: List[UploadFile] = File(...),
     format: str = "jpeg",
-    quality: int = 90
+    quality: int = 90,
+    max_edge: Optional[int] = None
 ):
     """배치 파일 변환"""
     
     if len(files) > 50:  # 한 번에 최대 50개 파일
         raise HTTPException(status_code=400, detail="최대 50개 파일까지 처리 가능합니다")
     
+    # 변환/ZIP 압축 방식/파일 이름이 모두 같은 값을 쓰도록 소문자로 정규화
+    format = format.lower()
+    if format not in converter.supported_formats:
+        raise HTTPException(status_code=400, detail=f"지원되는 형식: {converter.supported_formats}")
+    
+    if max_edge is not None and max_edge <= 0:
+        raise HTTPException(status_code=400, detail="max_edge는 1 이상이어야 합니다")
+    
     job_id = str(uuid.uuid4())
-    conversion_status[job_id] = {
+    status = {
         "status": "processing",
         "total": len(files),
         "completed": 0,
         "failed": 0,
-        "start_time": datetime.now(),
-        "result_file": None
+        "format": format,
+        "start_time": time.monotonic(),
+        "end_time": None,
+        "result_files": None
     }
+    conversion_status[job_id] = status
     
     # 백그라운드에서 변환 실행
-    background_tasks.add_task(process_batch_conversion, job_id, files, format, quality)
+    background_tasks.add_task(process_batch_conversion, job_id, status, files, format, quality, max_edge)
     
     return {"job_id": job_id, "message": "배치 변환이 시작되었습니다"}
 
-async def process_batch_conversion(job_id: str, files: List[UploadFile], format: str, quality: int):
-    """배치 변환 백그라운드 작업"""
+async def process_batch_conversion(job_id: str, status: dict, files: List[UploadFile], format: str, quality: int,
+                                   max_edge: Optional[int] = None):
+    """배치 변환 백그라운드 작업
+    
+    status는 conversion_status에 등록된 작업 상태 dict를 직접 받아서 갱신함
+    (작업이 끝나기 전에 TTL 만료/용량 초과로 캐시에서 빠져도 KeyError가 나지 않도록)
+    """
+    global active_jobs
     
     job_dir = TEMP_DIR / job_id
     job_dir.mkdir(exist_ok=True)
+    active_jobs += 1
     
     try:
-        converted_files = []
+        sem = asyncio.Semaphore(BATCH_CONCURRENCY)
+        # 변환이 끝난 순서대로 디스크에 기록 (큐 크기로 메모리에 쌓이는 결과 수 제한)
+        done_q = asyncio.Queue(maxsize=BATCH_CONCURRENCY)
         
-        for i, file in enumerate(files):
+        async def convert_one(i: int, file: UploadFile):
+            async with sem:
+                try:
+                    # 업로드 데이터를 메모리에서 바로 변환 (입력은 디스크에 쓰지 않고, 변환 결과만 job_dir에 저장)
+                    data = await file.read()
+                    converted = await converter.convert_bytes_async(data, format, quality, True, max_edge)
+                    await done_q.put((i, f"{Path(file.filename).stem}.{format}", converted))
+                    
+                    # 상태 업데이트
+                    status["completed"] += 1
+                    
+                except Exception as e:
+                    status["failed"] += 1
+                    print(f"파일 변환 실패 {file.filename}: {e}")
+        
+        async def save_results() -> list:
+            # ZIP은 다운로드 시점에 스트리밍으로 생성하므로 변환 결과와 ZIP 내 이름만 기록
+            manifest = []
+            used_names = set()
+            while (item := await done_q.get()) is not None:
+                i, name, data = item
+                # 같은 이름의 업로드(IMG_0001.heic / IMG_0001.HEIF 등)가 압축 해제 시 덮어쓰지 않도록 번호 추가
+                stem, ext = os.path.splitext(name)
+                suffix = i
+                while name in used_names:
+                    name = f"{stem}_{suffix}{ext}"
+                    suffix += 1
+                used_names.add(name)
+                output_path = job_dir / f"{i}_{name}"
+                await asyncio.to_thread(output_path.write_bytes, data)
+                manifest.append((str(output_path), name))
+            return manifest
+        
+        writer = asyncio.create_task(save_results())
+        
+        async def convert_all():
             try:
-                # 입력 파일 저장
-                input_path = job_dir / f"input_{i}_{file.filename}"
-                with open(input_path, "wb") as buffer:
-                    content = await file.read()
-                    buffer.write(content)
-                
-                # 변환 실행
-                output_path = converter.convert_file(input_path, format, quality)
-                converted_files.append(output_path)
-                
-                # 상태 업데이트
-                conversion_status[job_id]["completed"] += 1
-                
-            except Exception as e:
-                conversion_status[job_id]["failed"] += 1
-                print(f"파일 변환 실패 {file.filename}: {e}")
+                await asyncio.gather(*(convert_one(i, file) for i, file in enumerate(files)))
+            finally:
+                # 기록 작업이 살아 있으면 종료 신호 전달 (이미 실패했으면 가득 찬 큐에서 기다리지 않음)
+                if not writer.done():
+                    await done_q.put(None)
         
-        # ZIP 파일 생성
-        if converted_files:
-            zip_path = job_dir / f"converted_{job_id}.zip"
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for file_path in converted_files:
-                    zipf.write(file_path, file_path.name)
-            
-            conversion_status[job_id]["status"] = "completed"
-            conversion_status[job_id]["result_file"] = str(zip_path)
+        producer = asyncio.create_task(convert_all())
+        try:
+            _, manifest = await asyncio.gather(producer, writer)
+        except BaseException:
+            # 한쪽이 실패하면 다른 쪽이 큐에서 영원히 기다리지 않도록 함께 취소
+            producer.cancel()
+            writer.cancel()
+            raise
+        
+        if manifest:
+            status["status"] = "completed"
+            status["result_files"] = manifest
         else:
-            conversion_status[job_id]["status"] = "failed"
+            status["status"] = "failed"
             
     except Exception as e:
-        conversion_status[job_id]["status"] = "failed"
-        conversion_status[job_id]["error"] = str(e)
+        status["status"] = "failed"
+        status["error"] = str(e)
+    
+    finally:
+        active_jobs -= 1
+        status["end_time"] = time.monotonic()
 
 @app.get("/status/{job_id}")
 async def get_conversion_status(job_id: str):
@@ -201,7 +531,11 @@ async def get_conversion_status(job_id: str):
     if job_id not in conversion_status:
         raise HTTPException(status_code=404, detail="작업을 찾을 수 없습니다")
     
-    return conversion_status[job_id]
+    # 시작/종료 시각은 monotonic 값이므로 경과 시간으로 바꿔서 반환 (끝난 작업은 소요 시간)
+    status = dict(conversion_status[job_id])
+    end_time = status.pop("end_time") or time.monotonic()
+    status["elapsed_seconds"] = round(end_time - status.pop("start_time"), 3)
+    return status
 
 @app.get("/download/{job_id}")
 async def download_result(job_id: str):
@@ -210,33 +544,44 @@ async def download_result(job_id: str):
         raise HTTPException(status_code=404, detail="작업을 찾을 수 없습니다")
     
     status = conversion_status[job_id]
-    if status["status"] != "completed" or not status.get("result_file"):
+    if status["status"] != "completed" or not status.get("result_files"):
         raise HTTPException(status_code=400, detail="변환이 완료되지 않았습니다")
     
-    result_file = Path(status["result_file"])
-    if not result_file.exists():
+    result_files = [(Path(path), name) for path, name in status["result_files"]]
+    if not all(path.exists() for path, _ in result_files):
         raise HTTPException(status_code=404, detail="결과 파일을 찾을 수 없습니다")
     
-    return FileResponse(
-        path=result_file,
-        filename=f"converted_files_{job_id}.zip",
-        media_type="application/zip"
-    )
+    # ZIP을 디스크에 만들지 않고 응답 본문으로 바로 스트리밍
+    # (이미 압축된 형식은 재압축하지 않고, 비압축 BMP만 가볍게 압축)
+    if status["format"] in ('jpeg', 'jpg', 'webp', 'png'):
+        zs = ZipStream(compress_type=zipfile.ZIP_STORED, sized=True)
+    else:
+        zs = ZipStream(compress_type=zipfile.ZIP_DEFLATED, compress_level=1)
+    for path, name in result_files:
+        zs.add_path(path, arcname=name)
+    
+    headers = {"Content-Disposition": f'attachment; filename="converted_files_{job_id}.zip"'}
+    if zs.sized:
+        headers["Content-Length"] = str(len(zs))
+    
+    return StreamingResponse(zs, media_type="application/zip", headers=headers)
 
 @app.get("/health")
 async def health_check():
     """서비스 상태 확인"""
+    with os.scandir(TEMP_DIR) as entries:
+        temp_files = sum(1 for _ in entries)
+    
     return {
         "status": "healthy",
         "timestamp": datetime.now(),
-        "temp_files": len(list(TEMP_DIR.glob("*"))),
-        "active_jobs": len([j for j in conversion_status.values() if j["status"] == "processing"])
+        "temp_files": temp_files,
+        "active_jobs": active_jobs,
+        "worker_pool_restarts": pool_restarts
     }
 
-# 홈페이지 라우트 추가
-@app.get("/", response_class=HTMLResponse)
-async def home():
-    return """<!DOCTYPE html>
+# 홈페이지 HTML (요청마다 다시 인코딩하지 않도록 응답을 미리 생성)
+_HOME_HTML = """<!DOCTYPE html>
 <html>
 <head>
     <title>HEIC Converter</title>
@@ -434,6 +779,12 @@ async def home():
     </script>
 </body>
 </html>"""
+_HOME_RESPONSE = HTMLResponse(content=_HOME_HTML)
+
+# 홈페이지 라우트 추가
+@app.get("/", response_class=HTMLResponse)
+async def home():
+    return _HOME_RESPONSE
 
 if __name__ == "__main__":
     print("🚀 HEIC Converter API 시작 중...")